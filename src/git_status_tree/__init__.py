@@ -1,197 +1,283 @@
-import re
+import os
+import subprocess
 import sys
 
-import git
-from anytree import Node, RenderTree
-from colorama import Fore, Style, init
-
-_V2_PATTERN = re.compile(
-    r"""
-    # see git-status(1) for v2 porcelain format
-
-    (?P<ordinary>1)[ ]
-    (?P<xy>[MTADRCU.]{2})[ ]
-    (?:N\.{3}|S[C.][M.][U.])[ ]
-    (?:[0-7]{6}[ ]){3}
-    (?:[0-9a-f]+[ ]){2}
-    (?P<path>[^\x00]+)\x00
-|
-    (?P<renamed>2)[ ]
-    (?P<rxy>[MTADRCU.]{2})[ ]  # re module doesn't allow reusing group names
-                               # hence why we keep creating new yet very
-                               # similar group names.
-                               #
-                               # similary we're using ordinary/renamed/etc
-                               # groups as it's easier to reason about
-                               # than having a (?P<flag>) and then use
-                               # positive lookbehind in every alternative
-    (?:N\.{3}|S[C.][M.][U.])[ ]
-    (?:[0-7]{6}[ ]){3}
-    (?:[0-9a-f]+[ ]){2}
-    [RC][0-9]{1,3}[ ]
-    (?P<new_path>[^\x00]+)\x00
-    (?P<old_path>[^\x00]+)\x00
-|
-    (?P<unmerged>u)[ ]
-    (?P<uxy>[MTADRCU.]{2})[ ]
-    (?:N\.{3}|S[C.][M.][U.])[ ]
-    (?:[0-7]{6}[ ]){4}
-    (?:[0-9a-f]+[ ]){3}
-    (?P<unmerged_path>[^\x00]+)\x00
-|
-    (?P<untracked>[?])[ ]
-    (?P<untracked_path>[^\x00]+)\x00
-|
-    (?P<ignored>!)[ ]
-    (?P<ignored_path>[^\x00]+)\x00
-""",
-    re.VERBOSE,
-)
-
-
-def _parse_v2_statuses(v2statuses):
+# every two-char status git-status(1) can produce, mapped to a small int id:
+# a repo-sized path->status dict then holds shared ints instead of one string
+# per record, and the raw status bytes index straight into _STATUS_IDS
+# without even being decoded
+_STATUSES = [x + y for x in "MTADRCU." for y in "MTADRCU."] + ["??", "!!"]
+_STATUS_IDS = {status.encode(): i for i, status in enumerate(_STATUSES)}
+
+# see git-status(1) for those special cases
+_CONFLICT_STATES = frozenset({"DD", "AU", "UD", "UA", "DU", "AA", "UU"})
+
+
+def _build_status_colors():
+    # imported here (and in cli()) rather than at module level: colorama
+    # drags in its platform-specific stream machinery, which a piped
+    # invocation never needs, and import time is most of a CLI's startup
+    from colorama import Fore, Style
+
+    # there are only ~100 possible statuses, so color them all once up front
+    # and rendering becomes an indexed lookup per node
+    colors = []
+    for status in _STATUSES:
+        x, y = status
+
+        if x in "?!" or status in _CONFLICT_STATES:
+            colors.append(f"{Fore.RED}{x}{y}{Style.RESET_ALL}")
+            continue
+
+        colored_x = x if x == "." else f"{Fore.GREEN}{x}{Style.RESET_ALL}"
+        colored_y = y if y == "." else f"{Fore.RED}{y}{Style.RESET_ALL}"
+        colors.append(colored_x + colored_y)
+
+    return colors
+
+
+_STATUS_COLORS = None
+
+
+def _status_colors():
+    global _STATUS_COLORS
+    if _STATUS_COLORS is None:
+        _STATUS_COLORS = _build_status_colors()
+    return _STATUS_COLORS
+
+
+# record-type bytes, as ints since that's what indexing a bytes yields
+_ORDINARY, _RENAMED, _UNMERGED, _UNTRACKED, _IGNORED, _HEADER = b"12u?!#"
+
+
+def _iter_nul_fields(stream):
+    # yield the NUL-terminated fields of stream one by one, reading in large
+    # chunks so parsing can start while git is still producing output
+    tail = b""
+    while True:
+        # read1 hands back whatever the pipe has ready instead of blocking
+        # until a full 64 KiB accumulates, so we genuinely parse while git
+        # is still working; the tail carry below copes with short reads
+        data = stream.read1(65536)
+        if not data:
+            break
+
+        # a single C-level split scans the whole buffer for NULs in bulk;
+        # every piece but the last is a complete field, the last is a
+        # (possibly empty) partial field carried over to the next read
+        fields = (tail + data).split(b"\x00")
+        tail = fields.pop()
+        yield from fields
+
+    if tail:
+        yield tail
+
+
+def _parse_v2_statuses(fields):
+    # see git-status(1) for v2 porcelain format: records are NUL-terminated
+    # and paths are the only fields that may contain spaces, so each field is
+    # one record (renames get an extra field for the original path) and the
+    # headers are plain space-separated tokens we can skip over
     path_to_status = {}
     path_from_old_path = {}
-    for match in re.finditer(_V2_PATTERN, v2statuses):
-        if match.group("ordinary"):
-            xy = match.group("xy")
-            path = match.group("path")
+
+    for chunk in fields:
+        # indexing a bytes gives an int, which spares allocating a one-byte
+        # bytes object per record just for the dispatch
+        record_type = chunk[0]
+        if record_type == _ORDINARY:
+            xy = _STATUS_IDS[chunk[2:4]]
+            # <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            path = chunk.split(b" ", 8)[8].decode("utf-8", "surrogateescape")
             path_to_status[path] = xy
 
-        elif match.group("renamed"):
-            xy = match.group("rxy")
-            new_path = match.group("new_path")
-            old_path = match.group("old_path")
+        elif record_type == _RENAMED:
+            xy = _STATUS_IDS[chunk[2:4]]
+            # <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>
+            new_path = chunk.split(b" ", 9)[9].decode("utf-8", "surrogateescape")
+            # the original path is its own NUL-terminated field
+            old_path = next(fields).decode("utf-8", "surrogateescape")
             path_to_status[new_path] = xy
             path_from_old_path[new_path] = old_path
 
-        elif match.group("unmerged"):
-            xy = match.group("uxy")
-            unmerged_path = match.group("unmerged_path")
+        elif record_type == _UNMERGED:
+            xy = _STATUS_IDS[chunk[2:4]]
+            # <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+            unmerged_path = chunk.split(b" ", 10)[10].decode("utf-8", "surrogateescape")
             path_to_status[unmerged_path] = xy
 
-        elif match.group("untracked"):
-            untracked_path = match.group("untracked_path")
-            path_to_status[untracked_path] = "??"
+        elif record_type == _UNTRACKED:
+            untracked_path = chunk[2:].decode("utf-8", "surrogateescape")
+            path_to_status[untracked_path] = _STATUS_IDS[b"??"]
 
-        elif match.group("ignored"):
-            ignored_path = match.group("ignored_path")
-            path_to_status[ignored_path] = "!!"
+        elif record_type == _IGNORED:
+            ignored_path = chunk[2:].decode("utf-8", "surrogateescape")
+            path_to_status[ignored_path] = _STATUS_IDS[b"!!"]
+
+        elif record_type == _HEADER:
+            # headers only show up when flags like --branch are forwarded to
+            # git status; there's nothing to display for them
+            continue
 
         else:
-            raise
+            raise ValueError(f"unexpected status record: {chunk!r}")
 
     return path_to_status, path_from_old_path
 
 
 class Tree:
+    # nodes are plain ints indexing parallel lists rather than objects: a
+    # status tree can have thousands of nodes and per-node attribute dicts
+    # were most of the build cost
     def __init__(self):
+        self._names = []
+        self._status = []
+        self._old_path = []
+        self._children = []
         self._roots = []
         self._folders = {}
 
     def add(self, path, *, status, old_path=None):
-        return self._add(path, status=status, old_path=old_path, is_blob=True)
-
-    def _add(self, path, *, is_blob, status=None, old_path=None):
-        # the somewhat weird handling is ultimately down to git not normally
-        # knowing about directories, but it kinda does when doing things like
-        # git status --ignored where it *will* return folders-as-blobs, those
-        # end up with a `/` so we rely on this fact to properly handle those
-        # folders and give them status if relevant unlike 'regular' folders
-        is_root = path.count("/") == 0 or (path.count("/") == 1 and path.endswith("/"))
-        if is_root and is_blob:
-            node = Tree._node(path, status=status, old_path=old_path)
-            self._roots.append(node)
-
-        elif is_root:
-            if path in self._folders:
-                return self._folders[path]
-
-            node = Tree._node(path)
+        # git doesn't normally know about directories, but it kinda does when
+        # doing things like git status --ignored where it *will* return
+        # folders-as-blobs, those end up with a `/` so we rely on this fact to
+        # properly handle those folders and give them status if relevant
+        # unlike 'regular' folders
+        if path.endswith("/"):
+            parts = path[:-1].split("/")
+            parts[-1] += "/"
+        else:
+            parts = path.split("/")
+
+        # walk the intermediate components iteratively, creating each folder
+        # node at most once; keying on (parent, component) avoids rebuilding
+        # every "/".join'd prefix string along the way
+        parent = None
+        for part in parts[:-1]:
+            # components like src/ or tests/ repeat all over a repo;
+            # interning keeps one string per distinct component and makes the
+            # _folders lookups compare by pointer
+            part = sys.intern(part)
+            key = (parent, part)
+            folder = self._folders.get(key)
+            if folder is None:
+                folder = self._new_node(part, parent=parent)
+                self._folders[key] = folder
+            parent = folder
+
+        name = sys.intern(parts[-1])
+        self._new_node(name, parent=parent, status=status, old_path=old_path)
+
+    def _new_node(self, name, *, parent=None, status=None, old_path=None):
+        node = len(self._names)
+        self._names.append(name)
+        self._status.append(status)
+        self._old_path.append(old_path)
+        self._children.append([])
+        if parent is None:
             self._roots.append(node)
-            self._folders[path] = node
-            return node
-
-        elif is_blob:
-            parent, base = path.rstrip("/").rsplit("/", maxsplit=1)
-
-            if path.endswith("/"):
-                base += "/"
-
-            parent_node = self._add(parent, is_blob=False)
-            Tree._node(base, parent=parent_node, status=status, old_path=old_path)
-
         else:
-            if path in self._folders:
-                return self._folders[path]
+            self._children[parent].append(node)
+        return node
 
-            parent, base = path.rsplit("/", maxsplit=1)
-            parent_node = self._add(parent, is_blob=False)
-            node = Tree._node(base, parent=parent_node)
-            self._folders[path] = node
-            return node
+    def show(self, *, color=True):
+        # buffer everything and write once: print would take the stdout lock
+        # and flush for every single node
+        lines = []
 
-    def show(self):
         for root in self._roots:
-            for pre, _, node in RenderTree(root):
-                if node.status is None:
+            # each stack entry carries the prefix for the node's own line and
+            # the indent its children derive theirs from; children are pushed
+            # in reverse so they pop in insertion order
+            stack = [(root, "", "")]
+            while stack:
+                node, pre, indent = stack.pop()
+                status = self._status[node]
+                if status is None:
                     # this is a fake directory (i.e. a non-ignored one)
-                    print(f"{pre}{node.name}/")
+                    lines.append(f"{pre}{self._names[node]}/")
                 else:
-                    renamed = (
-                        f"{node.old_path} -> " if node.old_path is not None else ""
+                    old_path = self._old_path[node]
+                    renamed = f"{old_path} -> " if old_path is not None else ""
+                    colored = (
+                        Tree._colored_status(status) if color else _STATUSES[status]
                     )
-                    status = Tree._colored_status(node.status)
 
-                    print(f"{pre}{status} {renamed}{node.name}")
+                    lines.append(f"{pre}{colored} {renamed}{self._names[node]}")
 
-    @staticmethod
-    def _node(base, *, parent=None, status=None, old_path=None):
-        return Node(base, parent=parent, status=status, old_path=old_path)
+                for i, child in enumerate(reversed(self._children[node])):
+                    if i == 0:
+                        stack.append((child, indent + "└── ", indent + "    "))
+                    else:
+                        stack.append((child, indent + "├── ", indent + "│   "))
 
-    @staticmethod
-    def _colored_status(status):
-        x, y = status
+        if not lines:
+            return
 
-        # see git-status(1) for those special cases
-        if x in "?!" or status in [
-            "DD",
-            "AU",
-            "UD",
-            "UA",
-            "DU",
-            "AA",
-            "UU",
-        ]:
-            return f"{Fore.RED}{x}{y}{Style.RESET_ALL}"
+        output = "\n".join(lines) + "\n"
 
-        if x != ".":
-            x = f"{Fore.GREEN}{x}{Style.RESET_ALL}"
+        if color:
+            # when colors are on, colorama may have replaced sys.stdout with
+            # its ANSI-to-Win32 converting wrapper (whose fileno() is still
+            # the real fd), so writing to the fd directly would splat raw
+            # escape codes on legacy Windows consoles
+            sys.stdout.write(output)
+            return
 
-        if y != ".":
-            y = f"{Fore.RED}{y}{Style.RESET_ALL}"
+        try:
+            fd = sys.stdout.fileno()
+        except (OSError, ValueError):
+            # sys.stdout isn't backed by a real file descriptor (e.g. pytest
+            # capture or some other replacement stream)
+            fd = None
+
+        if fd is None:
+            sys.stdout.write(output)
+        else:
+            # encode once and skip the TextIOWrapper's per-write encoding
+            # and locking; surrogateescape round-trips non-UTF-8 path bytes
+            os.write(fd, output.encode("utf-8", "surrogateescape"))
 
-        return x + y
+    @staticmethod
+    def _colored_status(status):
+        return _status_colors()[status]
 
 
 def cli():
-    # if stdout is piped, disable colors
-    init()
+    # when stdout is piped there's no point emitting ANSI codes only for
+    # colorama's stream wrapper to strip them out of every write again, so
+    # skip both init() and the colors entirely; on a tty init() still makes
+    # the codes work on Windows
+    color = sys.stdout.isatty()
+    if color:
+        from colorama import init
+
+        init()
+
+    # no need for a git library here: git itself looks for the repository in
+    # parent directories, and -z paths are relative to the repo root no
+    # matter where we're invoked from
+    git_status = subprocess.Popen(
+        ["git", "status", "--porcelain=v2", "-z", *sys.argv[1:]],
+        stdout=subprocess.PIPE,
+    )
+    with git_status:
+        path_to_status, path_from_old_path = _parse_v2_statuses(
+            _iter_nul_fields(git_status.stdout)
+        )
 
-    repo = git.Repo(search_parent_directories=True)
-    v2statuses = repo.git.status("--porcelain=v2", "-z", *sys.argv[1:])
-    path_to_status, path_from_old_path = _parse_v2_statuses(v2statuses)
+    if git_status.returncode != 0:
+        # git already explained itself on stderr
+        sys.exit(git_status.returncode)
 
     # sort nested path first so they end up being printed first
-    sorted_statuses = dict(
-        sorted(
-            path_to_status.items(), key=lambda item: (-len(item[0].split("/")), item[0])
-        )
+    sorted_statuses = sorted(
+        path_to_status.items(), key=lambda item: (-item[0].count("/"), item[0])
     )
 
     tree = Tree()
 
-    for path, status in sorted_statuses.items():
+    for path, status in sorted_statuses:
         tree.add(path, status=status, old_path=path_from_old_path.get(path, None))
 
-    tree.show()
+    tree.show(color=color)